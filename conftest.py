@@ -1,7 +1,7 @@
 # conftest.py — shared pytest config
 
+import os
 import sys
-from pathlib import Path
 
 # Ensure the project root is in sys.path
-sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
\ No newline at end of file
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
\ No newline at end of file
@@ -6,9 +6,18 @@ Provides the main functionality for tagging modified lines in staged files.
 Used by both the CLI (lazytag.py) and Git hook integration.
 """
 
+import gc
+import json
+import os
+import shutil
 import subprocess
 import re
-from pathlib import Path
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from itertools import islice
 
 COMMENT_CHARS = {
     '.py': '#',
@@ -22,118 +31,230 @@ COMMENT_CHARS = {
     '.ada': '--',
 }
 
+# Extensions without the leading dot, for the cheap filter in _is_source_file
+_SOURCE_EXTS = frozenset(ext[1:] for ext in COMMENT_CHARS)
+
 MAX_LINE_LENGTH = 80
 
+# Changed lines are decoded with this; undecodable bytes round-trip via surrogateescape
+_SOURCE_ENCODING = 'utf-8'
+
+_PRINT_LOCK = threading.Lock()
+
+_BRANCH_RE = re.compile(r'([A-Z]+-\d+)')
+
+# Per-file (mtime, size, tag, hunks) from the last run, so pre-commit retries skip untouched files
+_SCAN_CACHE_PATH = os.path.join('.git', 'lazytag-cache.json')
+
+def _read_head_branch():
+    """Read the current branch from .git/HEAD without spawning git; None if unavailable."""
+    try:
+        with open(os.path.join('.git', 'HEAD')) as f:
+            head = f.read().strip()
+    except OSError:
+        return None  # Not at the top of a plain checkout (subdir, worktree, ...)
+    prefix = 'ref: refs/heads/'
+    return head[len(prefix):] if head.startswith(prefix) else 'HEAD'
+
 def get_branch_tag():
     try:
-        branch = subprocess.check_output(['git', 'rev-parse', '--abbrev-ref', 'HEAD']).decode().strip()
-        match = re.search(r'([A-Z]+-\d+)', branch)
+        branch = _read_head_branch()
+        # Ask git only when the file can't answer: it is missing, or it is the stub
+        # 'ref: refs/heads/.invalid' that reftable repositories keep there
+        if branch is None or branch == '.invalid':
+            branch = subprocess.check_output(['git', 'rev-parse', '--abbrev-ref', 'HEAD']).decode().strip()
+        match = _BRANCH_RE.search(branch)
         return match.group(1) if match else None
     except subprocess.CalledProcessError:
         return None
 
+def _is_source_file(path):
+    """Same answer as os.path.splitext(path)[1].lower() in COMMENT_CHARS, without the path machinery."""
+    head, dot, ext = path.rpartition('.')
+    if not dot or ext.lower() not in _SOURCE_EXTS:
+        return False
+    # Like splitext, a name made only of leading dots (".py") has no extension
+    return bool(head.rpartition('/')[2].strip('.'))
+
+# Retained as public API only: process_files_with_tag takes its staged file list
+# from the keys of get_all_diff_lines(), so nothing in core calls this any more
 def get_staged_files():
     output = subprocess.check_output(['git', 'diff', '--cached', '--name-only']).decode()
-    return [line.strip() for line in output.splitlines() if Path(line.strip()).suffix.lower() in COMMENT_CHARS]
+    paths = (line.strip() for line in output.splitlines())
+    return [p for p in paths if _is_source_file(p)]
+
+def _parse_hunk_header(line):
+    """Return (start, count) for the new-file side of an '@@ -a,b +c,d @@' header."""
+    fields = line.split(' ', 3)
+    if len(fields) < 3 or not fields[2].startswith('+'):
+        return None
+    start, _, count = fields[2][1:].partition(',')
+    return int(start), int(count) if count else 1
+
+def _parse_diff_hunks(diff_lines):
+    """Map each supported source file in a -U0 diff to its added (start, end) line hunks."""
+    changes = {}
+    current_file = None
+    in_header = False
+    for line in diff_lines:
+        if line.startswith('diff --git '):
+            in_header = True
+            current_file = None
+        elif in_header and line.startswith('+++ '):
+            path = line[6:].strip() if line.startswith('+++ b/') else None
+            current_file = path if path and _is_source_file(path) else None
+            if current_file:
+                changes[current_file] = []
+        elif line.startswith('@@'):
+            in_header = False
+            hunk = _parse_hunk_header(line) if current_file else None
+            if hunk and hunk[1]:
+                start, count = hunk
+                changes[current_file].append((start, start + count))
+    return changes
+
+# Pin the output format so user config (diff.noprefix, diff.mnemonicPrefix, color,
+# external diff drivers) can't change the '+++ b/<path>' headers the parser relies on
+_DIFF_FORMAT_ARGS = ['--no-color', '--no-ext-diff', '--src-prefix=a/', '--dst-prefix=b/', '--unified=0']
+
+def get_all_diff_lines(paths=None):
+    """Map every staged source file to its added line hunks using a single git diff."""
+    cmd = ['git', 'diff', '--cached', *_DIFF_FORMAT_ARGS]
+    if paths:
+        cmd += ['--', *paths]
+    # Parse while git is still writing instead of buffering the whole diff
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE, encoding='utf-8', errors='replace') as proc:
+        changes = _parse_diff_hunks(proc.stdout)
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
+    return changes
 
 def get_file_diff_lines(filename):
-    output = subprocess.check_output(['git', 'diff', '--cached', '-U0', filename]).decode()
-    changes = []
-    for line in output.splitlines():
-        if line.startswith('@@'):
-            m = re.search(r'\+(\d+)(?:,(\d+))?', line)
-            if m:
-                start = int(m.group(1))
-                count = int(m.group(2) or 1)
-                for i in range(start, start + count):
-                    changes.append(i)
-    return set(changes)
-
-def extract_tags(comment):
-    parts = re.split(r'[,\s]+', comment)
+    # Headers carry repo-root paths, which needn't match filename (subdirectory, "./x.py");
+    # the pathspec already limits the diff to this file, so take every hunk in it
+    return [hunk for hunks in get_all_diff_lines([filename]).values() for hunk in hunks]
+
+def _is_tag(s: str) -> bool:
+    # Equivalent to re.fullmatch(r'[A-Z]+-\d+', s) without the regex engine
+    i = s.find('-')
+    if i <= 0:
+        return False
+    head, tail = s[:i], s[i + 1:]
+    return head.isascii() and head.isalpha() and head.isupper() and tail.isdecimal()
+
+def extract_tags(comment: str, unique: bool = False) -> list[str]:
+    if '-' not in comment:
+        return []  # Every tag needs a dash; skip the split for plain comments
+    parts = comment.replace(',', ' ').split()
     tags = []
     for part in parts:
         cleaned = part.lstrip("/#-")
-        if re.fullmatch(r'[A-Z]+-\d+', cleaned):
+        if _is_tag(cleaned):
             tags.append(cleaned)
-    return tags
-
-def should_tag_comment_line(line, ext):
-    comment_char = COMMENT_CHARS.get(ext, '').lower()
-    stripped = line.strip().lower()
-    return (
-        stripped.startswith(f"{comment_char}deleted")  or 
-        stripped.startswith(f"{comment_char} deleted") or
-        stripped.startswith(f"{comment_char}delete")   or 
-        stripped.startswith(f"{comment_char} delete")  or 
-        stripped.startswith(f"{comment_char}remove")   or 
-        stripped.startswith(f"{comment_char} remove")  or 
-        stripped.startswith(f"{comment_char}removed")  or 
-        stripped.startswith(f"{comment_char} removed") or
-        stripped.startswith(f"{comment_char}move")     or 
-        stripped.startswith(f"{comment_char} move")    or
-        stripped.startswith(f"{comment_char}moved")    or
-        stripped.startswith(f"{comment_char} moved")
-    )
+    return list(dict.fromkeys(tags)) if unique else tags
+
+def _deleted_marker_re(comment_char):
+    # "delete"/"remove"/"move" also cover their "-d" forms
+    return re.compile(rf'\s*{re.escape(comment_char)} ?(?:delete|remove|move)', re.IGNORECASE)
 
-def is_code_line(line, ext):
+_DELETED_MARKER_RES = {ext: _deleted_marker_re(c) for ext, c in COMMENT_CHARS.items()}
+
+def should_tag_comment_line(line: str, ext: str) -> bool:
+    marker_re = _DELETED_MARKER_RES.get(ext) or _deleted_marker_re('')
+    return marker_re.match(line) is not None
+
+def is_code_line(line: str, ext: str) -> bool:
     stripped = line.strip()
     return bool(stripped) and not stripped.startswith(COMMENT_CHARS[ext])
 
-def align_tags_with_comments(line, tags, comment_char, new_tag):
+def align_tags_with_comments(line: str, tags: list[str], comment_char: str, new_tag: str) -> str:
     """Preserve original inline comments and spacing. Append tag block only at the end."""
-    all_existing_tags = extract_tags(line)
-    if new_tag in all_existing_tags:
-        return line  # Already tagged
+    text = line.rstrip("\n")
 
-    line = line.rstrip("\n")
-
-    comment_start = line.find(comment_char)
+    comment_start = text.find(comment_char)
     if comment_start != -1:
-        code_part = line[:comment_start].rstrip()
-        comment_part = line[comment_start:].strip()
+        code_part = text[:comment_start].rstrip()
+        comment_part = text[comment_start:].rstrip()
     else:
-        code_part = line
+        code_part = text
         comment_part = ""
 
-    # Extract tags from the comment part
-    existing_tags = extract_tags(comment_part)
-    if new_tag not in existing_tags:
-        existing_tags.append(new_tag)
-
-    # Rebuild a single clean tag comment block
-    tag_comment = f"{comment_char} {', '.join(existing_tags)}"
-
-    # Align to column 80 if there's no original comment
-    if not comment_part or comment_part.strip() in [comment_char, ""]:
-        padding = max(1, 80 - len(code_part) - len(tag_comment))
-        return f"{code_part}{' ' * padding}{tag_comment}"
+    # Tags can only live in the comment, so a single pass over it serves both checks
+    if new_tag in extract_tags(comment_part):
+        return line  # Already tagged
+    return _align_split_code_line(code_part, comment_part, comment_char, new_tag)
 
-    # Otherwise preserve comment and just add tag if needed
-    if comment_part.startswith(comment_char):
+def _align_split_code_line(code_part: str, comment_part: str, comment_char: str, new_tag: str) -> str:
+    """Tag a code line that the caller has already split at its first comment char."""
+    # Preserve an existing comment and just append the tag to it
+    if comment_part and comment_part != comment_char:
         comment_text = comment_part[len(comment_char):].strip()
         return f"{code_part} {comment_char} {comment_text}, {new_tag}"
 
+    # No original comment (or an empty one): add a fresh tag block aligned to column 80
+    tag_comment = f"{comment_char} {new_tag}"
+    width = MAX_LINE_LENGTH - len(tag_comment)
+    if len(code_part) < width:
+        return f"{code_part.ljust(width)}{tag_comment}"
     return f"{code_part} {tag_comment}"
 
 
-def align_tags_to_col_80_preserve_deleted(line, tags, comment_char, new_tag):
-    if new_tag not in tags:
-        tags.append(new_tag)
+def align_tags_to_col_80_preserve_deleted(line: str, tags: list[str], comment_char: str, new_tag: str) -> str:
+    if new_tag in tags:
+        return line  # Already tagged
+    tags = [*dict.fromkeys(tags), new_tag]
 
     tag_block = f"{comment_char} {', '.join(tags)}"
-    line = line.rstrip()
+    code_part = line.rstrip()
     tag_search_start = 40
-    tag_pos = line.find(comment_char, tag_search_start)
-    code_part = line[:tag_pos].rstrip() if tag_pos != -1 else line.rstrip()
+    tag_pos = code_part.find(comment_char, tag_search_start)
+    if tag_pos != -1:
+        code_part = code_part[:tag_pos].rstrip()
+
+    width = MAX_LINE_LENGTH - len(tag_block)
+    if len(code_part) < width:
+        return f"{code_part.ljust(width)}{tag_block}"
+    return f"{code_part} {tag_block}"
+
+def _printable(line):
+    """Render a surrogateescape-decoded line for the log, showing undecodable bytes as \\xNN."""
+    return line.encode(_SOURCE_ENCODING, 'surrogateescape').decode(_SOURCE_ENCODING, 'backslashreplace')
+
+_ALREADY_TAGGED = object()
+
+def _make_line_tagger(comment_char):
+    """Build a per-line tagger with the comment char and its marker pattern bound once."""
+    deleted_re = _deleted_marker_re(comment_char)
+    tail_offset = len(comment_char)
+
+    def tag_line(original, tag):
+        """Return the tagged line, _ALREADY_TAGGED, or None if this kind of line is never tagged."""
+        # Tags only live in the comment tail; tokenise it only when the tag text occurs at all
+        pos = original.find(comment_char)
+        tail = original[pos + tail_offset:] if pos != -1 else ""
+        if tag in tail and tag in extract_tags(tail):
+            return _ALREADY_TAGGED
+
+        stripped = original.strip()
+        if not stripped:
+            return None
+        if not stripped.startswith(comment_char):
+            # Reuse the comment position found above instead of searching the line again
+            if pos == -1:
+                return _align_split_code_line(original, "", comment_char, tag)
+            return _align_split_code_line(original[:pos].rstrip(), original[pos:].rstrip(), comment_char, tag)
+        if deleted_re.match(stripped):
+            # Only this branch rebuilds the tag list; code lines keep their comment verbatim
+            return align_tags_to_col_80_preserve_deleted(original, extract_tags(tail, unique=True), comment_char, tag)
+        return None
 
-    total_len = len(code_part) + 1 + len(tag_block)
-    if total_len > MAX_LINE_LENGTH:
-        return f"{code_part} {tag_block}"
-    else:
-        padding = MAX_LINE_LENGTH - len(code_part) - len(tag_block)
-        return f"{code_part}{' ' * padding}{tag_block}"
+    return tag_line
 
+_TAGGERS_BY_CHAR = {c: _make_line_tagger(c) for c in set(COMMENT_CHARS.values())}
+_LINE_TAGGERS = {ext: _TAGGERS_BY_CHAR[c] for ext, c in COMMENT_CHARS.items()}
+
+# get_merge_base and get_diff_lines_from_base are retained as public API only; base
+# scope now uses get_diff_lines_against_branch, which lets git find the merge-base
 def get_merge_base(base_branch="origin/development") -> str:
     def run_merge_base(branch):
         return subprocess.run(
@@ -153,26 +274,72 @@ def get_merge_base(base_branch="origin/development") -> str:
         else:
             raise RuntimeError(f"Could not find merge base with '{base_branch}' or fallback '{fallback}'.")
 
-def get_diff_lines_from_base(base_commit: str) -> dict[str, set[int]]:
+def get_diff_lines_from_base(base_commit: str) -> dict[str, list[tuple[int, int]]]:
     result = subprocess.run(
-        ["git", "diff", "--unified=0", base_commit, "HEAD"],
+        ["git", "diff", *_DIFF_FORMAT_ARGS, base_commit, "HEAD"],
         capture_output=True, text=True, check=True
     )
-    diff_text = result.stdout
-    changes = {}
-    current_file = None
+    return _parse_diff_hunks(result.stdout.splitlines())
 
-    for line in diff_text.splitlines():
-        if line.startswith("+++ b/"):
-            current_file = line[6:].strip()
-            changes[current_file] = set()
-        elif line.startswith("@@") and current_file:
-            match = re.search(r'\+(\d+)(?:,(\d+))?', line)
-            if match:
-                start = int(match.group(1))
-                count = int(match.group(2)) if match.group(2) else 1
-                changes[current_file].update(range(start, start + count))
-    return changes
+def get_diff_lines_against_branch(base_branch="origin/development") -> dict[str, list[tuple[int, int]]]:
+    """Diff HEAD against its merge-base with base_branch in a single git call."""
+    def run_diff(branch):
+        # "branch...HEAD" diffs from the merge-base, so no separate merge-base lookup is needed
+        return subprocess.run(
+            ["git", "diff", *_DIFF_FORMAT_ARGS, f"{branch}...HEAD"],
+            capture_output=True, text=True
+        )
+
+    result = run_diff(base_branch)
+    if result.returncode != 0:
+        fallback = "main"
+        result = run_diff(fallback)
+        if result.returncode != 0:
+            raise RuntimeError(f"Could not find merge base with '{base_branch}' or fallback '{fallback}'.")
+        print(f"[WARN] Branch '{base_branch}' not found. Falling back to '{fallback}'.")
+    return _parse_diff_hunks(result.stdout.splitlines())
+
+def _load_scan_cache():
+    try:
+        with open(_SCAN_CACHE_PATH) as f:
+            written_ns = os.fstat(f.fileno()).st_mtime_ns
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(cache, dict):
+        return {}
+    # Like git's racy-index check: an entry whose mtime isn't strictly older than the
+    # cache file could hide a same-size edit made in the same timestamp tick
+    return {
+        f: key for f, key in cache.items()
+        if isinstance(key, list) and key and isinstance(key[0], int) and key[0] < written_ns
+    }
+
+def _save_scan_cache(cache):
+    try:
+        out = tempfile.NamedTemporaryFile(
+            'w', dir=os.path.dirname(_SCAN_CACHE_PATH),
+            prefix='lazytag-cache.', suffix='.tmp', delete=False
+        )
+    except OSError:
+        return  # No .git directory here; the cache is only an optimisation
+    try:
+        with out:
+            json.dump(cache, out)
+        os.replace(out.name, _SCAN_CACHE_PATH)
+    except OSError:
+        os.unlink(out.name)  # A failed write only costs the next run a rescan
+    except BaseException:
+        os.unlink(out.name)
+        raise
+
+def _scan_key(filepath, tag, hunks):
+    """What a finished scan of filepath depends on, in JSON form; None if the file is gone."""
+    try:
+        st = os.stat(filepath)
+    except OSError:
+        return None
+    return [st.st_mtime_ns, st.st_size, tag, [list(h) for h in hunks]]
 
 def process_files_with_tag(preferred_tag=None, dry_run=False, scope="staged", base_branch="origin/development"):
     tag = preferred_tag or get_branch_tag()
@@ -182,25 +349,67 @@ def process_files_with_tag(preferred_tag=None, dry_run=False, scope="staged", ba
 
     if scope == "base":
         try:
-            base_commit = get_merge_base(base_branch)
+            all_changes = get_diff_lines_against_branch(base_branch)
         except RuntimeError as e:
             print(f"[ERROR] {e}")
             return
-        all_changes = get_diff_lines_from_base(base_commit)
     else:
-        files = get_staged_files()
-        all_changes = {f: get_file_diff_lines(f) for f in files}
+        all_changes = get_all_diff_lines()
 
-    files_to_process = list(all_changes.keys())
+    # Files with no added lines (pure deletions, mode changes) never reach the pool
+    files_to_process = [f for f, hunks in all_changes.items() if hunks]
 
     if not files_to_process:
         print("[INFO] No modified source files to process.")
         return
 
+    # Dry runs always scan, so they report every line they would touch
+    cache = {} if dry_run else _load_scan_cache()
+    if cache:
+        scanned = len(files_to_process)
+        files_to_process = [
+            f for f in files_to_process
+            if cache.get(f) is None or cache[f] != _scan_key(f, tag, all_changes[f])
+        ]
+        if len(files_to_process) < scanned:
+            print(f"[INFO] {scanned - len(files_to_process)} file(s) unchanged since the last run")
+
     print(f"[INFO] Tagging with: {tag}\n")
 
-    for file in files_to_process:
-        process_file(file, tag, dry_run=dry_run, override_lines=all_changes[file])
+    modified_files = []
+    if files_to_process:
+        # The per-line work allocates lots of short-lived strings but no cycles,
+        # so keep the cyclic GC from firing during the pass
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            # Files are independent, so overlap their I/O; restaging stays on this thread
+            with ThreadPoolExecutor(max_workers=min(8, len(files_to_process))) as executor:
+                results = executor.map(
+                    lambda f: process_file(f, tag, dry_run=dry_run, override_lines=all_changes[f]),
+                    files_to_process
+                )
+                modified_files = [written for written in results if written]
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+
+    if modified_files and not dry_run:
+        try:
+            subprocess.run(['git', 'add', '--', *modified_files], check=True)
+        except subprocess.CalledProcessError as e:
+            # Leave the cache alone, so the next run retags and restages these files
+            print(f"[ERROR] Could not restage tagged files (git add exited with {e.returncode})")
+            return
+
+    if not dry_run:
+        # Record the post-write stat so an identical rerun can skip these files
+        cache = {f: key for f, key in cache.items() if f in all_changes}
+        for f in files_to_process:
+            key = _scan_key(f, tag, all_changes[f])
+            if key is not None:
+                cache[f] = key
+        _save_scan_cache(cache)
 
     if dry_run:
         print("\n[DRY-RUN] Complete. No files were modified.")
@@ -208,48 +417,94 @@ def process_files_with_tag(preferred_tag=None, dry_run=False, scope="staged", ba
         print("\n[SUCCESS] Tagging complete.")
 
 def process_file(filepath, tag, dry_run=False, override_lines=None):
-    ext = Path(filepath).suffix.lower()
-    comment_char = COMMENT_CHARS[ext]
+    ext = os.path.splitext(filepath)[1].lower()
+    tag_line = _LINE_TAGGERS[ext]
     changes = override_lines if override_lines is not None else get_file_diff_lines(filepath)
+    if not changes:
+        return None
+    comment_char = COMMENT_CHARS[ext]
+    comment_bytes = comment_char.encode(_SOURCE_ENCODING)
+    tagged_tails = (f"{comment_char} {tag}".encode(_SOURCE_ENCODING), f", {tag}".encode(_SOURCE_ENCODING))
 
-    with open(filepath, 'r') as f:
-        lines = f.readlines()
-
-    updated_lines = []
     modified = False
+    log = []  # Printed in one block so parallel files don't interleave
+    out = None
 
-    for idx, line in enumerate(lines, start=1):
-        original = line.rstrip('\n')
-        modified_line = original
-        update_needed = False
-
-        if idx in changes:
-            existing_all_tags = extract_tags(original)
-            if tag in existing_all_tags:
-                if dry_run:
-                    print(f"[SKIP]    {filepath}:{idx} (tag already exists)")
-                update_needed = False
+    try:
+        # Work on raw bytes so untouched lines (and their line endings) are copied
+        # without a decode/encode round trip; only changed lines are decoded
+        with open(filepath, 'rb') as src:
+            if not dry_run:
+                # Stream into a sibling temp file and swap it in only if something was tagged;
+                # created after the source opened, so a missing file leaves nothing behind
+                out = tempfile.NamedTemporaryFile(
+                    'wb', dir=os.path.dirname(filepath) or '.',
+                    prefix=f".{os.path.basename(filepath)}.", suffix='.lazytag.tmp', delete=False
+                )
+            with (out if out is not None else nullcontext()):
+                idx = 1
+                for start, end in changes:
+                    if start > idx:
+                        # Lines between hunks are copied through without inspection
+                        gap = islice(src, start - idx)
+                        if out is not None:
+                            out.write(b''.join(gap))
+                        else:
+                            deque(gap, maxlen=0)
+                        idx = start
+
+                    for raw in islice(src, max(0, end - idx)):
+                        body = raw.rstrip(b'\r\n')
+                        update_needed = False
+
+                        if body.rstrip().endswith(tagged_tails) and comment_bytes in body:
+                            # Reruns mostly see lines already ending in this tag; skip decode and parse
+                            tagged = _ALREADY_TAGGED
+                        else:
+                            original = body.decode(_SOURCE_ENCODING, 'surrogateescape')
+                            tagged = tag_line(original, tag)
+
+                        if tagged is _ALREADY_TAGGED:
+                            if dry_run:
+                                log.append(f"[SKIP]    {filepath}:{idx} (tag already exists)")
+                        elif tagged is not None and tagged != original:
+                            # Only real content changes count, so a no-op rewrite never reaches disk
+                            modified_line = tagged
+                            update_needed = True
+
+                        if update_needed:
+                            modified = True
+                            log_type = "DRY-RUN" if dry_run else "TAGGED"
+                            log.append(
+                                f"[{log_type}] {filepath}:{idx}\n"
+                                f"  BEFORE: {_printable(original)}\n  AFTER:  {_printable(modified_line)}\n"
+                            )
+
+                        if out is not None:
+                            if update_needed:
+                                out.write(modified_line.encode(_SOURCE_ENCODING, 'surrogateescape') + raw[len(body):])
+                            else:
+                                out.write(raw)
+                        idx += 1
+
+                if out is not None:
+                    shutil.copyfileobj(src, out)
+
+        if out is not None:
+            if modified:
+                shutil.copymode(filepath, out.name)
+                os.replace(out.name, filepath)
             else:
-                if is_code_line(original, ext):
-                    match = re.search(rf'{re.escape(comment_char)}\s*(.*)$', original)
-                    tags = extract_tags(match.group(1)) if match else []
-                    modified_line = align_tags_with_comments(original, tags, comment_char, tag)
-                    update_needed = True
-
-                elif should_tag_comment_line(original, ext):
-                    match = re.search(rf'{re.escape(comment_char)}\s*(.*)$', original)
-                    tags = extract_tags(match.group(1)) if match else []
-                    modified_line = align_tags_to_col_80_preserve_deleted(original, tags, comment_char, tag)
-                    update_needed = True
-
-        if update_needed:
-            modified = True
-            log_type = "DRY-RUN" if dry_run else "TAGGED"
-            print(f"[{log_type}] {filepath}:{idx}\n  BEFORE: {original}\n  AFTER:  {modified_line}\n")
-
-        updated_lines.append(modified_line + '\n')
-
-    if modified and not dry_run:
-        with open(filepath, 'w') as f:
-            f.writelines(updated_lines)
-        subprocess.run(['git', 'add', filepath])
+                os.unlink(out.name)
+    except BaseException:
+        if out is not None:
+            os.unlink(out.name)
+        raise
+
+    # Only log once the file is settled, so a failing print (closed pipe, unencodable
+    # text) can't strand the temp file or abandon the rewrite
+    if log:
+        with _PRINT_LOCK:
+            print("\n".join(log))
+
+    return filepath if modified and out is not None else None
@@ -18,6 +18,9 @@ import re
 import subprocess
 import sys
 import argparse
+import gc
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 COMMENT_CHARS = {
@@ -33,14 +36,25 @@ COMMENT_CHARS = {
 }
 
 MAX_LINE_LENGTH = 80
+SPACES = ' ' * MAX_LINE_LENGTH  # Padding is sliced from this instead of built per line
 DRY_RUN = False  # Will be set inside main() by argparse
+PRINT_LOCK = threading.Lock()  # Keeps each file's log block together when run in parallel
+
+# Compiled once at import instead of on every per-line call
+TAG_RE = re.compile(r'[A-Z]+-\d+')
+BRANCH_TAG_RE = re.compile(r'([A-Z]+-\d+)')
+HUNK_RE = re.compile(r'\+(\d+)(?:,(\d+))?')
+# Fixed diff format, so diff.noprefix / diff.mnemonicPrefix can't change the '+++ b/' headers
+DIFF_ARGS = ['--no-color', '--no-ext-diff', '--src-prefix=a/', '--dst-prefix=b/', '-U0']
+COMMENT_RE = {ext: re.compile(re.escape(c) + r'\s*(.*)$') for ext, c in COMMENT_CHARS.items()}
+DELETED_PREFIXES = {ext: (f"{c.lower()}deleted", f"{c.lower()} deleted") for ext, c in COMMENT_CHARS.items()}
 
 
 def get_branch_tag():
     """Extract the Jira-style tag from the current branch name."""
     try:
         branch = subprocess.check_output(['git', 'rev-parse', '--abbrev-ref', 'HEAD']).decode().strip()
-        match = re.search(r'([A-Z]+-\d+)', branch)
+        match = BRANCH_TAG_RE.search(branch)
         return match.group(1) if match else None
     except subprocess.CalledProcessError:
         return None
@@ -53,44 +67,73 @@ def get_staged_files():
 
 
 def get_file_diff_lines(filename):
-    """Return the line numbers that are modified in the staged diff for a file."""
-    output = subprocess.check_output(['git', 'diff', '--cached', '-U0', filename]).decode()
-    changes = []
+    """Return the sorted (start, end) line intervals modified in the staged diff for a file."""
+    output = subprocess.check_output(['git', 'diff', '--cached', *DIFF_ARGS, '--', filename]).decode()
+    intervals = []
     for line in output.splitlines():
         if line.startswith('@@'):
-            m = re.search(r'\+(\d+)(?:,(\d+))?', line)
+            m = HUNK_RE.search(line)
+            if m:
+                start = int(m.group(1))
+                count = int(m.group(2) or 1)
+                intervals.append((start, start + count))
+    return sorted(intervals)
+
+
+def get_staged_diff_lines():
+    """Return {filepath: sorted (start, end) intervals} for all staged files from one git diff."""
+    output = subprocess.check_output(['git', 'diff', '--cached', *DIFF_ARGS]).decode()
+    changes = {}
+    intervals = None
+    in_header = False
+    for line in output.splitlines():
+        if line.startswith('diff --git '):
+            in_header = True
+            intervals = None
+        elif in_header and line.startswith('+++ b/'):
+            intervals = changes.setdefault(line[6:].strip(), [])
+        elif line.startswith('@@'):
+            in_header = False
+            m = HUNK_RE.search(line) if intervals is not None else None
             if m:
                 start = int(m.group(1))
                 count = int(m.group(2) or 1)
-                for i in range(start, start + count):
-                    changes.append(i)
-    return set(changes)
+                intervals.append((start, start + count))
+    return changes
 
 
 def extract_tags(comment):
-    """Extract all Jira-style tags from an inline comment block."""
-    return [t.strip() for t in comment.split(',') if re.match(r'[A-Z]+-\d+', t)]
+    """Extract the distinct Jira-style tags from an inline comment block, in order."""
+    return list(dict.fromkeys(t.strip() for t in comment.split(',') if TAG_RE.match(t.strip())))
 
 
 def should_tag_comment_line(line, ext):
     """Check if this comment line is a 'deleted' marker (e.g., # deleted ...)."""
-    comment_char = COMMENT_CHARS.get(ext, '').lower()
-    stripped = line.strip().lower()
-    return stripped.startswith(f"{comment_char}deleted") or stripped.startswith(f"{comment_char} deleted")
+    prefixes = DELETED_PREFIXES.get(ext, ('deleted', ' deleted'))
+    return line.strip().lower().startswith(prefixes)
 
 
 def is_code_line(line, ext):
     """Return True if the line is a valid code line (not blank or comment)."""
-    stripped = line.strip()
-    return bool(stripped) and not stripped.startswith(COMMENT_CHARS[ext])
+    return classify_line(line.strip(), COMMENT_CHARS[ext], DELETED_PREFIXES[ext]) == LINE_CODE
+
+
+LINE_OTHER, LINE_CODE, LINE_DELETED = range(3)
+
+
+def classify_line(stripped, comment_char, deleted_prefixes):
+    """Classify an already-stripped line as code, a 'deleted' marker, or anything else."""
+    if not stripped:
+        return LINE_OTHER
+    if not stripped.startswith(comment_char):
+        return LINE_CODE
+    if stripped.lower().startswith(deleted_prefixes):
+        return LINE_DELETED
+    return LINE_OTHER
 
 
 def align_tags_with_comments(line, tags, comment_char, new_tag):
     """Preserve existing inline comments and append Jira tags at the end, aligned to column 80."""
-    if new_tag not in tags:
-        tags.append(new_tag)
-
-    tag_block = f"{comment_char} {', '.join(tags)}"
     line = line.rstrip()
 
     if comment_char in line:
@@ -100,6 +143,19 @@ def align_tags_with_comments(line, tags, comment_char, new_tag):
     else:
         code_part = line
         comment_part = ""
+    aligned = align_split_code_line(code_part, comment_part, tags, comment_char, new_tag)
+    return line if aligned is None else aligned
+
+
+def align_split_code_line(code_part, comment_part, tags, comment_char, new_tag):
+    """Like align_tags_with_comments, for a line already split at its comment; None if nothing to add."""
+    # Tags already written in the comment are not repeated in the appended block
+    written = extract_tags(comment_part[len(comment_char):]) if comment_part else []
+    new_tags = [t for t in dict.fromkeys([*tags, new_tag]) if t not in written]
+    if not new_tags:
+        return None
+
+    tag_block = f"{comment_char} {', '.join(new_tags)}"
 
     # Combine original comment and new tag
     if comment_part:
@@ -112,11 +168,12 @@ def align_tags_with_comments(line, tags, comment_char, new_tag):
         return f"{code_part} {combined_comment}"
     else:
         padding = MAX_LINE_LENGTH - len(code_part) - len(combined_comment)
-        return f"{code_part}{' ' * padding}{combined_comment}"
+        return f"{code_part}{SPACES[:padding]}{combined_comment}"
 
 
 def align_tags_to_col_80_preserve_deleted(line, tags, comment_char, new_tag):
     """Align tags to column 80 for 'deleted' lines without removing their original content."""
+    tags = list(dict.fromkeys(tags))  # A copy, so the caller's list is left as it was
     if new_tag not in tags:
         tags.append(new_tag)
 
@@ -127,62 +184,87 @@ def align_tags_to_col_80_preserve_deleted(line, tags, comment_char, new_tag):
     tag_search_start = 40
     tag_pos = line.find(comment_char, tag_search_start)
 
-    if tag_pos != -1:
-        code_part = line[:tag_pos].rstrip()
-    else:
-        code_part = line.rstrip()
+    # line is already rstripped, so only a split at the comment needs another strip
+    code_part = line[:tag_pos].rstrip() if tag_pos != -1 else line
 
     total_len = len(code_part) + 1 + len(tag_block)
     if total_len > MAX_LINE_LENGTH:
         return f"{code_part} {tag_block}"
     else:
         padding = MAX_LINE_LENGTH - len(code_part) - len(tag_block)
-        return f"{code_part}{' ' * padding}{tag_block}"
+        return f"{code_part}{SPACES[:padding]}{tag_block}"
 
 
-def process_file(filepath, tag):
+def process_file(filepath, tag, changes=None):
     """Process and tag modified lines in a source file."""
     ext = Path(filepath).suffix.lower()
     comment_char = COMMENT_CHARS[ext]
-    changes = get_file_diff_lines(filepath)
-
-    with open(filepath, 'r') as f:
-        lines = f.readlines()
+    if changes is None:
+        changes = get_file_diff_lines(filepath)
+    if not changes:
+        return None  # Nothing added in this file, so don't even open it
+    # Everything the per-line loop touches is bound here, so it only does local lookups
+    comment_search = COMMENT_RE[ext].search
+    deleted_prefixes = DELETED_PREFIXES[ext]
+    classify, extract = classify_line, extract_tags
+    align_code, align_del = align_split_code_line, align_tags_to_col_80_preserve_deleted
+    log_type = "DRY-RUN" if DRY_RUN else "TAGGED"
+    comment_bytes = comment_char.encode()
+    tagged_tails = (f"{comment_char} {tag}".encode(), f", {tag}".encode())
+
+    # Keep the original bytes; untouched lines are written back exactly as they were read
+    with open(filepath, 'rb') as f:
+        lines = f.read().splitlines(keepends=True)
 
-    updated_lines = []
     modified = False
+    log = []
+
+    # Only visit the changed intervals instead of walking every line of the file
+    for start, end in changes:
+        for idx in range(start, min(end, len(lines) + 1)):
+            raw = lines[idx - 1]
+            body = raw.rstrip(b'\r\n')
+            if body.rstrip().endswith(tagged_tails) and comment_bytes in body:
+                continue  # Already carries this tag (a rerun); skip the decode and alignment
+            original = body.decode('utf-8', 'surrogateescape')
+
+            # Strip once and classify, rather than once per predicate
+            kind = classify(original.strip(), comment_char, deleted_prefixes)
+            if kind == LINE_CODE:
+                # Extract tags from any existing inline comment, and reuse the match to split the line
+                match = comment_search(original)
+                if match:
+                    pos = match.start()
+                    code_part, comment_part = original[:pos].rstrip(), original[pos:].rstrip()
+                    modified_line = align_code(code_part, comment_part, extract(match.group(1)), comment_char, tag)
+                else:
+                    modified_line = align_code(original.rstrip(), "", [], comment_char, tag)
+
+            elif kind == LINE_DELETED:
+                # Handle "# deleted ..." or "// deleted ..." lines
+                match = comment_search(original)
+                tags = extract(match.group(1)) if match else []
+                modified_line = align_del(original, tags, comment_char, tag)
 
-    for idx, line in enumerate(lines, start=1):
-        original = line.rstrip('\n')
-        modified_line = original
-        update_needed = False
-
-        if idx in changes:
-            if is_code_line(original, ext):
-                # Extract tags from any existing inline comment
-                match = re.search(rf'{re.escape(comment_char)}\s*(.*)$', original)
-                tags = extract_tags(match.group(1)) if match else []
-                modified_line = align_tags_with_comments(original, tags, comment_char, tag)
-                update_needed = True
+            else:
+                continue
 
-            elif should_tag_comment_line(original, ext):
-                # Handle "# deleted ..." or "// deleted ..." lines
-                match = re.search(rf'{re.escape(comment_char)}\s*(.*)$', original)
-                tags = extract_tags(match.group(1)) if match else []
-                modified_line = align_tags_to_col_80_preserve_deleted(original, tags, comment_char, tag)
-                update_needed = True
+            if modified_line is None or modified_line == original:
+                continue
 
-        if update_needed:
             modified = True
-            log_type = "DRY-RUN" if DRY_RUN else "TAGGED"
-            print(f"[{log_type}] {filepath}:{idx} --> {modified_line}")
+            log.append(f"[{log_type}] {filepath}:{idx} --> {modified_line}")
+            lines[idx - 1] = modified_line.encode('utf-8', 'surrogateescape') + raw[len(body):]
 
-        updated_lines.append(modified_line + '\n')
+    if log:
+        with PRINT_LOCK:
+            print("\n".join(log))
 
     if modified and not DRY_RUN:
-        with open(filepath, 'w') as f:
-            f.writelines(updated_lines)
-        subprocess.run(['git', 'add', filepath])  # Restage
+        with open(filepath, 'wb') as f:
+            f.write(b''.join(lines))
+        return filepath  # Restaged by main() together with the other files
+    return None
 
 
 def main():
@@ -199,14 +281,29 @@ def main():
         print("[ERROR] No Jira-style tag found (use --tag or a branch like SMR-1010-feature).")
         sys.exit(1)
 
-    files = get_staged_files()
+    # The one staged diff yields both the file list and every file's hunks
+    all_changes = get_staged_diff_lines()
+    files = [f for f, hunks in all_changes.items() if hunks and Path(f).suffix.lower() in COMMENT_CHARS]
     if not files:
         print("[INFO] No staged source files to process.")
         sys.exit(0)
 
     print(f"[INFO] Tagging with: {tag}\n")
-    for file in files:
-        process_file(file, tag)
+    # Tagging allocates many short-lived strings and no cycles, so pause the cyclic GC
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        # Files are independent, so overlap their reads and writes on a small pool
+        with ThreadPoolExecutor(max_workers=min(8, len(files))) as executor:
+            results = executor.map(lambda f: process_file(f, tag, all_changes[f]), files)
+            modified_files = [written for written in results if written]
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+    # Restage everything in one git call instead of one per file
+    if modified_files and not DRY_RUN:
+        subprocess.run(['git', 'add', '--', *modified_files], check=True)
 
     if DRY_RUN:
         print("\n[DRY-RUN] Complete. No files were modified.")
@@ -1,5 +1,12 @@
+import os
 from setuptools import setup, find_packages
 
+# Opt-in: LAZYTAG_MYPYC=1 compiles core.py to a C extension (needs mypy in the build env)
+ext_modules = []
+if os.environ.get("LAZYTAG_MYPYC") == "1":
+    from mypyc.build import mypycify
+    ext_modules = mypycify(["core.py"])
+
 setup(
     name="lazytag",
     version="0.1.0",
@@ -8,6 +15,7 @@ setup(
     author_email="sebastian@apostrofo.com",
     packages=find_packages(),
     py_modules=["lazytag", "core", "installer"],
+    ext_modules=ext_modules,
     entry_points={
         "console_scripts": [
             "lazytag = lazytag:main"
@@ -2,6 +2,10 @@
 test_core.py — Unit tests for LazyTag core tagging logic
 """
 
+import gc
+import io
+import os
+import subprocess
 import pytest
 from core import (
     extract_tags,
@@ -11,7 +15,15 @@ from core import (
     is_code_line,
     COMMENT_CHARS,
     MAX_LINE_LENGTH,
-    get_merge_base
+    get_merge_base,
+    get_all_diff_lines,
+    get_file_diff_lines,
+    process_files_with_tag,
+    process_file,
+    get_diff_lines_from_base,
+    get_branch_tag,
+    get_diff_lines_against_branch,
+    get_staged_files
 )
 from pathlib import Path
 from unittest import mock
@@ -44,6 +56,18 @@ def test_align_tags_preserve_deleted_line():
     assert "OLD-1" in result and "NEW-2" in result
     assert len(result) == MAX_LINE_LENGTH or result.endswith("NEW-2")
 
+def test_align_tags_pads_to_column_80_or_falls_back_to_one_space():
+    fits = "x" * 64  # 64 + len("# SMR-1010") + padding == 80
+    assert align_tags_to_col_80_preserve_deleted(fits, [], "#", "SMR-1010") == fits + " " * 6 + "# SMR-1010"
+    tight = "x" * 70
+    assert align_tags_to_col_80_preserve_deleted(tight, [], "#", "SMR-1010") == tight + " # SMR-1010"
+    assert align_tags_with_comments(tight, [], "#", "SMR-1010") == tight + " # SMR-1010"
+    assert len(align_tags_with_comments("int x;", [], "//", "SMR-1010")) == MAX_LINE_LENGTH
+
+def test_align_tags_preserve_deleted_line_already_tagged():
+    line = "# deleted print('Done')                                    # OLD-1"
+    assert align_tags_to_col_80_preserve_deleted(line, ["OLD-1"], "#", "OLD-1") == line
+
 def test_should_tag_comment_line():
     assert should_tag_comment_line("//deleted something", ".cpp")
     assert should_tag_comment_line("// deleted something", ".c")
@@ -52,6 +76,13 @@ def test_should_tag_comment_line():
     assert not should_tag_comment_line("//normal comment", ".cpp")
     assert not should_tag_comment_line("deleted x = 10", ".py")
 
+def test_should_tag_comment_line_remove_and_move_markers():
+    assert should_tag_comment_line("   // Removed call", ".cpp")
+    assert should_tag_comment_line("#remove x", ".py")
+    assert should_tag_comment_line("-- moved to util.adb", ".adb")
+    assert should_tag_comment_line("//MOVE", ".rs")
+    assert not should_tag_comment_line("//  moved", ".c")
+
 def test_is_code_line():
     assert is_code_line("int x = 10;", ".c")
     assert is_code_line("   let x = 5;", ".rs")
@@ -69,6 +100,18 @@ def test_extract_tags_handles_spaces_and_commas():
     assert extract_tags("// SMR-1010, SMR-1010") == ["SMR-1010", "SMR-1010"]
     assert extract_tags("// SMR-1010 XYZ-999") == ["SMR-1010", "XYZ-999"]
 
+def test_extract_tags_rejects_malformed_tokens():
+    assert extract_tags("abc-123, ABC-, -123, ABC-12a, AB1-2") == []
+    assert extract_tags("ABC-123-456 DEF-7") == ["DEF-7"]
+
+def test_extract_tags_unique_keeps_first_occurrence_order():
+    assert extract_tags("// SMR-1010, ABC-1, SMR-1010", unique=True) == ["SMR-1010", "ABC-1"]
+
+def test_align_deleted_line_collapses_duplicate_tags():
+    line = "# deleted x = 1                                      # OLD-1, OLD-1"
+    result = align_tags_to_col_80_preserve_deleted(line, ["OLD-1", "OLD-1"], "#", "NEW-2")
+    assert result.endswith("# OLD-1, NEW-2")
+
 def test_extract_tags_handles_punctuation():
     assert extract_tags("//SMR-1010") == ["SMR-1010"]
     assert extract_tags("#SMR-1010") == ["SMR-1010"]
@@ -134,4 +177,258 @@ def test_get_merge_base_with_fallback():
         assert result == "abc123fallback"
         assert mock_run.call_count == 2
         mock_run.assert_any_call(["git", "merge-base", "HEAD", "origin/development"], capture_output=True, text=True)
-        mock_run.assert_any_call(["git", "merge-base", "HEAD", "development"], capture_output=True, text=True)
\ No newline at end of file
+        mock_run.assert_any_call(["git", "merge-base", "HEAD", "development"], capture_output=True, text=True)
+
+def test_get_all_diff_lines_parses_single_diff():
+    diff = (
+        "diff --git a/src/main.c b/src/main.c\n"
+        "index 1111111..2222222 100644\n"
+        "--- a/src/main.c\n"
+        "+++ b/src/main.c\n"
+        "@@ -3 +3,2 @@\n"
+        "-int x;\n"
+        "+int x = 1;\n"
+        "+int y = 2;\n"
+        "@@ -10,0 +12 @@\n"
+        "+++ not a header\n"
+        "diff --git a/README.md b/README.md\n"
+        "--- a/README.md\n"
+        "+++ b/README.md\n"
+        "@@ -1 +1 @@\n"
+        "+text\n"
+        "diff --git a/old.py b/old.py\n"
+        "--- a/old.py\n"
+        "+++ /dev/null\n"
+        "@@ -1,2 +0,0 @@\n"
+    )
+    with mock.patch("subprocess.Popen") as mock_popen:
+        proc = mock_popen.return_value.__enter__.return_value
+        proc.stdout = io.StringIO(diff)
+        proc.returncode = 0
+        result = get_all_diff_lines()
+    assert result == {"src/main.c": [(3, 5), (12, 13)]}
+    assert mock_popen.call_args[0][0] == ["git", "diff", "--cached", "--no-color", "--no-ext-diff", "--src-prefix=a/", "--dst-prefix=b/", "--unified=0"]
+
+
+def test_get_file_diff_lines_ignores_header_path():
+    # From a subdirectory the header says "sub/s.py" while the caller passed "s.py"
+    with mock.patch("core.get_all_diff_lines", return_value={"sub/s.py": [(1, 2)]}) as mock_diff:
+        assert get_file_diff_lines("s.py") == [(1, 2)]
+    mock_diff.assert_called_once_with(["s.py"])
+
+
+def test_process_files_with_tag_restages_once(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    Path("a.py").write_text("x = 1\ny = 2\n")
+    Path("b.c").write_text("int z;\n")
+    Path("c.rs").write_text("let w = 0; // SMR-1010\n")
+    changes = {"a.py": [(2, 3)], "b.c": [(1, 2)], "c.rs": [(1, 2)]}
+    with mock.patch("core.get_all_diff_lines", return_value=changes), \
+         mock.patch("subprocess.run") as mock_run:
+        process_files_with_tag(preferred_tag="SMR-1010")
+    mock_run.assert_called_once_with(["git", "add", "--", "a.py", "b.c"], check=True)
+    assert Path("a.py").read_text() == "x = 1\ny = 2" + " " * 65 + "# SMR-1010\n"
+    assert Path("b.c").read_text().rstrip("\n").endswith("// SMR-1010")
+    assert Path("c.rs").read_text() == "let w = 0; // SMR-1010\n"
+
+
+def test_process_file_skips_files_without_added_lines(tmp_path):
+    missing = tmp_path / "gone.py"
+    assert process_file(str(missing), "SMR-1010", override_lines=[]) is None
+
+def test_process_file_only_touches_lines_in_hunks(tmp_path):
+    src = tmp_path / "m.py"
+    src.write_text("a = 1\nb = 2\nc = 3\nd = 4\ne = 5")
+    result = process_file(str(src), "SMR-1010", override_lines=[(2, 3), (4, 6)])
+    assert result == str(src)
+    lines = src.read_text().split("\n")
+    assert lines[0] == "a = 1"
+    assert lines[1].endswith("# SMR-1010") and lines[1].startswith("b = 2")
+    assert lines[2] == "c = 3"
+    assert lines[3].endswith("# SMR-1010") and lines[4].endswith("# SMR-1010")
+    assert [p.name for p in tmp_path.iterdir()] == ["m.py"]
+
+def test_get_diff_lines_from_base_parses_hunk_headers():
+    diff = (
+        "diff --git a/lib.rs b/lib.rs\n"
+        "--- a/lib.rs\n"
+        "+++ b/lib.rs\n"
+        "@@ -1,0 +2,3 @@ fn main() {\n"
+        "@@ -9 +12 @@\n"
+        "@@ -20,4 +22,0 @@\n"
+        "diff --git a/notes.txt b/notes.txt\n"
+        "--- a/notes.txt\n"
+        "+++ b/notes.txt\n"
+        "@@ -1 +1 @@\n"
+    )
+    with mock.patch("subprocess.run", return_value=mock.Mock(stdout=diff)):
+        result = get_diff_lines_from_base("abc123")
+    assert result == {"lib.rs": [(2, 5), (12, 13)]}
+
+def test_get_branch_tag_reads_head_without_git(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / ".git").mkdir()
+    (tmp_path / ".git" / "HEAD").write_text("ref: refs/heads/SMR-1010-feature\n")
+    with mock.patch("subprocess.check_output") as mock_out:
+        assert get_branch_tag() == "SMR-1010"
+        (tmp_path / ".git" / "HEAD").write_text("0123456789abcdef0123456789abcdef01234567\n")
+        assert get_branch_tag() is None
+        (tmp_path / ".git" / "HEAD").write_text("ref: refs/heads/main\n")
+        assert get_branch_tag() is None
+    mock_out.assert_not_called()
+
+def test_get_branch_tag_asks_git_for_reftable_stub_head(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / ".git").mkdir()
+    (tmp_path / ".git" / "HEAD").write_text("ref: refs/heads/.invalid\n")
+    with mock.patch("subprocess.check_output", return_value=b"SMR-1010-feature\n") as mock_out:
+        assert get_branch_tag() == "SMR-1010"
+    mock_out.assert_called_once_with(["git", "rev-parse", "--abbrev-ref", "HEAD"])
+
+def test_get_diff_lines_against_branch_falls_back_to_main():
+    diff = "diff --git a/x.py b/x.py\n--- a/x.py\n+++ b/x.py\n@@ -0,0 +1,2 @@\n"
+    with mock.patch("subprocess.run") as mock_run:
+        mock_run.side_effect = [
+            mock.Mock(returncode=128, stdout=""),
+            mock.Mock(returncode=0, stdout=diff),
+        ]
+        result = get_diff_lines_against_branch("origin/development")
+    assert result == {"x.py": [(1, 3)]}
+    mock_run.assert_any_call(["git", "diff", "--no-color", "--no-ext-diff", "--src-prefix=a/", "--dst-prefix=b/", "--unified=0", "origin/development...HEAD"], capture_output=True, text=True)
+    mock_run.assert_any_call(["git", "diff", "--no-color", "--no-ext-diff", "--src-prefix=a/", "--dst-prefix=b/", "--unified=0", "main...HEAD"], capture_output=True, text=True)
+
+def test_process_file_leaves_untagged_file_alone(tmp_path):
+    src = tmp_path / "done.c"
+    src.write_text("int a; // SMR-1010\n// plain comment\n")
+    before = src.stat().st_mtime_ns
+    assert process_file(str(src), "SMR-1010", override_lines=[(1, 3)]) is None
+    assert src.stat().st_mtime_ns == before
+    assert [p.name for p in tmp_path.iterdir()] == ["done.c"]
+
+def test_process_file_dry_run_reports_existing_tag(tmp_path, capsys):
+    src = tmp_path / "t.adb"
+    src.write_text("X := 1; -- note, SMR-1010\nY := 2;\n")
+    assert process_file(str(src), "SMR-1010", dry_run=True, override_lines=[(1, 3)]) is None
+    out = capsys.readouterr().out
+    assert f"[SKIP]    {src}:1 (tag already exists)" in out
+    assert f"[DRY-RUN] {src}:2" in out
+    assert src.read_text() == "X := 1; -- note, SMR-1010\nY := 2;\n"
+
+def test_get_staged_files_filters_supported_extensions():
+    names = "src/a.py\nREADME.md\nlib/B.CPP\n.py\nMakefile\ndocs.c/index.txt\n"
+    with mock.patch("subprocess.check_output", return_value=names.encode()):
+        assert get_staged_files() == ["src/a.py", "lib/B.CPP"]
+
+def test_process_file_preserves_crlf_and_non_utf8_bytes(tmp_path):
+    src = tmp_path / "w.c"
+    src.write_bytes(b"int a;\r\nchar *s = \"\xe9\";\r\nint b;\r\n")
+    assert process_file(str(src), "SMR-1010", override_lines=[(2, 3)]) == str(src)
+    lines = src.read_bytes().split(b"\r\n")
+    assert lines[0] == b"int a;"
+    assert lines[1].startswith(b"char *s = \"\xe9\";") and lines[1].endswith(b"// SMR-1010")
+    assert lines[2:] == [b"int b;", b""]
+
+def test_process_files_with_tag_skips_files_unchanged_since_last_run(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / ".git").mkdir()
+    Path("a.py").write_text("x = 1\n")
+    changes = {"a.py": [(1, 2)]}
+    with mock.patch("core.get_all_diff_lines", return_value=changes), \
+         mock.patch("subprocess.run"):
+        process_files_with_tag(preferred_tag="SMR-1010")
+        # Age the cache past a.py's mtime, or the entry is treated as racy and rescanned
+        cache_path = tmp_path / ".git" / "lazytag-cache.json"
+        later = cache_path.stat().st_mtime_ns + 10**9
+        os.utime(cache_path, ns=(later, later))
+        with mock.patch("core.process_file") as mock_process:
+            process_files_with_tag(preferred_tag="SMR-1010")
+            mock_process.assert_not_called()
+            assert "[SUCCESS]" in capsys.readouterr().out
+            process_files_with_tag(preferred_tag="SMR-2020")
+            mock_process.assert_called_once()
+    assert [p.name for p in (tmp_path / ".git").iterdir()] == ["lazytag-cache.json"]
+
+def test_scan_cache_distrusts_entries_as_new_as_the_cache(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / ".git").mkdir()
+    Path("a.py").write_text("x = 1  # SMR-1010\n")
+    changes = {"a.py": [(1, 2)]}
+    with mock.patch("core.get_all_diff_lines", return_value=changes), \
+         mock.patch("subprocess.run"):
+        process_files_with_tag(preferred_tag="SMR-1010")
+        # A same-size edit in the tick the cache was written must not be skipped
+        cache_path = tmp_path / ".git" / "lazytag-cache.json"
+        mtime = Path("a.py").stat().st_mtime_ns
+        os.utime(cache_path, ns=(mtime, mtime))
+        with mock.patch("core.process_file") as mock_process:
+            process_files_with_tag(preferred_tag="SMR-1010")
+        mock_process.assert_called_once()
+
+def test_process_files_with_tag_failed_restage_is_not_cached(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / ".git").mkdir()
+    Path("a.py").write_text("x = 1\n")
+    failed_add = subprocess.CalledProcessError(128, ["git", "add"])
+    with mock.patch("core.get_all_diff_lines", return_value={"a.py": [(1, 2)]}), \
+         mock.patch("subprocess.run", side_effect=failed_add):
+        process_files_with_tag(preferred_tag="SMR-1010")
+    out = capsys.readouterr().out
+    assert "[ERROR] Could not restage" in out and "[SUCCESS]" not in out
+    assert not (tmp_path / ".git" / "lazytag-cache.json").exists()
+
+def test_process_file_leaves_lines_ending_in_the_tag_alone(tmp_path):
+    src = tmp_path / "f.c"
+    src.write_bytes(b"int a; // SMR-1010\nint b; // ABC-1, SMR-1010  \nint c; // SMR-10100\n")
+    assert process_file(str(src), "SMR-1010", override_lines=[(1, 4)]) == str(src)
+    lines = src.read_bytes().split(b"\n")
+    assert lines[:2] == [b"int a; // SMR-1010", b"int b; // ABC-1, SMR-1010  "]
+    assert lines[2].endswith(b"// SMR-10100, SMR-1010")
+def test_process_files_with_tag_restores_gc_state_after_errors(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    was_enabled = gc.isenabled()
+    try:
+        for enabled in (True, False):
+            if enabled:
+                gc.enable()
+            else:
+                gc.disable()
+            with mock.patch("core.get_all_diff_lines", return_value={"a.py": [(1, 2)]}), \
+                 mock.patch("core.process_file", side_effect=OSError("boom")):
+                with pytest.raises(OSError):
+                    process_files_with_tag(preferred_tag="SMR-1010")
+            assert gc.isenabled() is enabled
+    finally:
+        if was_enabled:
+            gc.enable()
+
+def test_process_file_finishes_rewrite_when_logging_fails(tmp_path):
+    src = tmp_path / "w.c"
+    src.write_text("int w;\n")
+    with mock.patch("builtins.print", side_effect=BrokenPipeError):
+        with pytest.raises(BrokenPipeError):
+            process_file(str(src), "SMR-1010", override_lines=[(1, 2)])
+    assert src.read_text().rstrip("\n").endswith("// SMR-1010")
+    assert [p.name for p in tmp_path.iterdir()] == ["w.c"]
+
+def test_process_file_missing_source_leaves_no_temp_file(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        process_file(str(tmp_path / "gone.c"), "SMR-1010", override_lines=[(1, 2)])
+    assert list(tmp_path.iterdir()) == []
+
+def test_process_file_logs_non_utf8_bytes_to_strict_stdout(tmp_path, monkeypatch):
+    src = tmp_path / "w.c"
+    src.write_bytes(b"char c = '\xe9';\n")
+    stdout = io.TextIOWrapper(io.BytesIO(), encoding="utf-8", errors="strict")
+    monkeypatch.setattr("sys.stdout", stdout)
+    assert process_file(str(src), "SMR-1010", override_lines=[(1, 2)]) == str(src)
+    stdout.flush()
+    assert b"BEFORE: char c = '\\xe9';" in stdout.buffer.getvalue()
+    assert src.read_bytes().startswith(b"char c = '\xe9';")
+
+def test_process_file_tags_lines_whose_comments_only_resemble_the_tag(tmp_path):
+    src = tmp_path / "t.py"
+    src.write_text("x = 1  # SMR-10100\ny = 2  # see ABC-1\n")
+    assert process_file(str(src), "SMR-1010", override_lines=[(1, 3)]) == str(src)
+    lines = src.read_text().splitlines()
+    assert lines[0].startswith("x = 1") and lines[0].endswith("# SMR-10100, SMR-1010")
+    assert lines[1].startswith("y = 2") and lines[1].endswith("# see ABC-1, SMR-1010")
@@ -0,0 +1,118 @@
+"""
+test_tag_commit_hook.py — Unit tests for the legacy pre-commit hook
+"""
+
+import gc
+from pathlib import Path
+from unittest import mock
+
+import pytest
+
+from legacy import tag_commit_hook as hook
+
+
+def test_get_staged_diff_lines_parses_headers_and_hunks():
+    diff = (
+        "diff --git a/src/main.c b/src/main.c\n"
+        "--- a/src/main.c\n"
+        "+++ b/src/main.c\n"
+        "@@ -3,0 +3,2 @@\n"
+        "++++ not a header\n"
+        "@@ -20 +12 @@\n"
+        "diff --git a/old.py b/old.py\n"
+        "--- a/old.py\n"
+        "+++ /dev/null\n"
+        "@@ -1,2 +0,0 @@\n"
+    )
+    with mock.patch("subprocess.check_output", return_value=diff.encode()) as mock_out:
+        result = hook.get_staged_diff_lines()
+    assert result == {"src/main.c": [(3, 5), (12, 13)]}
+    cmd = mock_out.call_args[0][0]
+    assert "--src-prefix=a/" in cmd and "--dst-prefix=b/" in cmd
+
+
+def test_process_file_splices_only_changed_lines(tmp_path):
+    src = tmp_path / "m.py"
+    src.write_bytes(b"a = 1\r\nb = 2\r\nc = 3\r\nd = 4")
+    assert hook.process_file(str(src), "SMR-1010", [(2, 3), (4, 5)]) == str(src)
+    lines = src.read_bytes().split(b"\r\n")
+    assert lines[0] == b"a = 1" and lines[2] == b"c = 3"
+    assert lines[1].startswith(b"b = 2") and lines[1].endswith(b"# SMR-1010")
+    # The last line had no newline and still has none
+    assert lines[3].startswith(b"d = 4") and lines[3].endswith(b"# SMR-1010")
+    assert len(lines) == 4
+
+
+def test_process_file_leaves_untagged_file_alone(tmp_path):
+    src = tmp_path / "m.py"
+    src.write_bytes(b"# just a comment\n\n")
+    assert hook.process_file(str(src), "SMR-1010", [(1, 3)]) is None
+    assert src.read_bytes() == b"# just a comment\n\n"
+
+
+def test_main_restages_modified_files_once(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    Path("a.py").write_text("x = 1\n")
+    Path("b.c").write_text("int y;\n")
+    Path("notes.md").write_text("text\n")
+    changes = {"a.py": [(1, 2)], "b.c": [(1, 2)], "notes.md": [(1, 2)], "gone.py": []}
+    monkeypatch.setattr("sys.argv", ["tag_commit_hook.py", "--tag", "SMR-1010"])
+    with mock.patch.object(hook, "get_staged_diff_lines", return_value=changes), \
+         mock.patch("subprocess.run") as mock_run:
+        hook.main()
+    mock_run.assert_called_once_with(["git", "add", "--", "a.py", "b.c"], check=True)
+    assert Path("notes.md").read_text() == "text\n"
+
+
+def test_extract_tags_drops_duplicates():
+    assert hook.extract_tags("SMR-1, ABC-2, SMR-1") == ["SMR-1", "ABC-2"]
+
+
+def test_align_tags_with_comments_does_not_repeat_existing_tags():
+    result = hook.align_tags_with_comments("w = 3 # ABC-1", ["ABC-1"], "#", "SMR-1010")
+    assert result.startswith("w = 3")
+    assert result.endswith("# ABC-1 # SMR-1010")
+    assert result.count("ABC-1") == 1
+
+
+def test_align_deleted_dedupes_without_touching_callers_list():
+    tags = ["ABC-1", "ABC-1"]
+    result = hook.align_tags_to_col_80_preserve_deleted("# deleted x", tags, "#", "SMR-1010")
+    assert result.endswith("# ABC-1, SMR-1010")
+    assert tags == ["ABC-1", "ABC-1"]
+
+
+def test_process_file_skips_lines_already_tagged(tmp_path):
+    src = tmp_path / "z.py"
+    src.write_bytes(b"z = 2 # SMR-1010\ny = 1 # ABC-1, SMR-1010\nx = 0 # SMR-10100\n")
+    assert hook.process_file(str(src), "SMR-1010", [(1, 4)]) == str(src)
+    lines = src.read_bytes().split(b"\n")
+    assert lines[:2] == [b"z = 2 # SMR-1010", b"y = 1 # ABC-1, SMR-1010"]
+    assert lines[2].endswith(b"# SMR-10100 # SMR-1010")
+
+
+def test_process_file_reuses_comment_match_to_split_code_lines(tmp_path):
+    src = tmp_path / "c.c"
+    src.write_bytes(b"int a;   // units, ABC-1\nint b;\nint c;      // SMR-1010 note, SMR-1010\n")
+    assert hook.process_file(str(src), "SMR-1010", [(1, 4)]) == str(src)
+    lines = src.read_bytes().split(b"\n")
+    assert lines[0].startswith(b"int a; ") and lines[0].endswith(b"// units, ABC-1 // SMR-1010")
+    assert len(lines[0]) == hook.MAX_LINE_LENGTH
+    assert lines[1].startswith(b"int b;") and lines[1].endswith(b"// SMR-1010")
+    assert lines[2] == b"int c;      // SMR-1010 note, SMR-1010"
+
+
+def test_main_leaves_gc_disabled_if_it_was(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr("sys.argv", ["tag_commit_hook.py", "--tag", "SMR-1010"])
+    was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        with mock.patch.object(hook, "get_staged_diff_lines", return_value={"a.py": [(1, 2)]}), \
+             mock.patch.object(hook, "process_file", side_effect=OSError("boom")):
+            with pytest.raises(OSError):
+                hook.main()
+        assert not gc.isenabled()
+    finally:
+        if was_enabled:
+            gc.enable()